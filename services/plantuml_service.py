@@ -1,18 +1,20 @@
 from __future__ import annotations
 
 import os
+import re
 import shutil
 import tempfile
-from dataclasses import dataclass
+import time
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Union
 
 import jpype
 from jpype import JClass
 import logging
 import hashlib
 from collections import OrderedDict
-from threading import RLock
+from threading import Event, Lock, RLock, Thread
 
 
 @dataclass
@@ -21,12 +23,91 @@ class RenderResult:
     file_path: Path
     bytes_data: bytes
     svg_text: Optional[str] = None
+    cache_key: Optional[str] = None
 
 
 class PlantUMLError(Exception):
     pass
 
 
+class PlantUMLCancelled(PlantUMLError):
+    pass
+
+
+class PlantUMLTimeout(PlantUMLError):
+    pass
+
+
+class RenderCancelToken:
+    # 由调用方持有：新的编辑到来时 cancel()，正在进行的渲染会尽快中止。
+    # group 标识渲染归属（如某个文档）：同组同一时刻至多一个JVM渲染在执行。
+    # 优先级与超时可在渲染过程中调整（如后台文档切换为可见），直接作用于执行渲染的Java线程
+    def __init__(self, group: object = None, low_priority: bool = False, timeout: Optional[float] = None) -> None:
+        self._event = Event()
+        self.group = group
+        self._lock = Lock()
+        self._low_priority = low_priority
+        self._timeout = timeout
+        self._jthread = None
+        self._render: Optional[_RenderSlot] = None
+
+    def cancel(self) -> None:
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    @property
+    def timeout(self) -> Optional[float]:
+        return self._timeout
+
+    def set_timeout(self, timeout: Optional[float]) -> None:
+        # 覆盖调用 render 时传入的超时。渲染进行中调整时从此刻重新计时，但不会缩短已有的截止时间
+        self._timeout = timeout
+
+    def set_low_priority(self, low_priority: bool) -> None:
+        with self._lock:
+            self._low_priority = low_priority
+            jthread = self._jthread
+        if jthread is not None:
+            _apply_thread_priority(jthread, low_priority)
+
+    def wait_render_exited(self, timeout: Optional[float] = None) -> bool:
+        # 等待与本令牌关联的JVM渲染线程真正结束（被放弃的渲染也会跑完）；未启动过渲染时立即返回
+        render = self._render
+        return render.finished.wait(timeout) if render is not None else True
+
+    @property
+    def render_overdue(self) -> bool:
+        # 关联的JVM渲染已超过截止时间仍未结束：视为挂起，不再阻塞同组渲染
+        render = self._render
+        return render is not None and render.overdue()
+
+    def _bind_render(self, render: _RenderSlot) -> None:
+        self._render = render
+
+    def _bind_thread(self, jthread) -> None:
+        with self._lock:
+            self._jthread = jthread
+            low_priority = self._low_priority
+        if low_priority:
+            _apply_thread_priority(jthread, True)
+
+
+def _apply_thread_priority(jthread, low_priority: bool) -> None:
+    # 通过 Java 线程优先级调整（Windows 下映射为系统线程优先级）
+    try:
+        thread_cls = JClass("java.lang.Thread")
+        jthread.setPriority(thread_cls.MIN_PRIORITY if low_priority else thread_cls.NORM_PRIORITY)
+    except Exception:
+        pass
+
+
+# 等待渲染线程时检查取消/超时的间隔（秒）
+_CANCEL_POLL_INTERVAL = 0.05
+
+
 class PlantUMLService:
     def __init__(self, jar_path: str):
         self.jar_path = jar_path
@@ -39,6 +120,9 @@ class PlantUMLService:
         self._ByteArrayOutputStream = None
         self._lock = RLock()
         self._cache = _LRUCache(32)
+        self._includes = _IncludeResolver()
+        # 各组占用槽位的JVM渲染线程（含被取代但尚未结束的）；超时的渲染立即让出槽位
+        self._inflight: dict[object, _RenderSlot] = {}
         self._target_dir = Path(tempfile.gettempdir()) / "PlanUmlUtil"
         self._target_dir.mkdir(parents=True, exist_ok=True)
 
@@ -66,21 +150,129 @@ class PlantUMLService:
         except Exception as e:
             raise PlantUMLError(f"Failed to load PlantUML API classes: {e}")
 
-    def render(self, uml_text: str, fmt: str = "png", dpi: Optional[int] = None, scale: Optional[float] = None) -> RenderResult:
+    def render(
+        self,
+        uml_text: str,
+        fmt: str = "png",
+        dpi: Optional[int] = None,
+        scale: Optional[float] = None,
+        timeout: Optional[float] = None,
+        cancel: Optional[RenderCancelToken] = None,
+        base_dir: Optional[Union[str, Path]] = None,
+    ) -> RenderResult:
         if fmt not in {"png", "svg"}:
             raise PlantUMLError(f"Unsupported format: {fmt}")
 
         self.start_jvm()
         if not self._classes_loaded:
             self._load_classes()
-        if not jpype.isThreadAttachedToJVM():
+        self._attach_current_thread()
+
+        processed_text, digest = self._prepare(uml_text, fmt, dpi, scale, base_dir)
+        cached = self._cached_result(digest, fmt)
+        if cached is not None:
+            return cached
+
+        if cancel is not None and cancel.cancelled:
+            raise PlantUMLCancelled("渲染已取消")
+        if timeout is None and cancel is None:
+            data = self._output_image(processed_text, fmt, dpi, scale)
+            return self._store(digest, fmt, data)
+        return self._render_interruptible(processed_text, digest, fmt, dpi, scale, timeout, cancel)
+
+    def _store(self, digest: str, fmt: str, data: bytes) -> RenderResult:
+        out_name = f"diagram_{digest}.{fmt}"
+        final_path = self._target_dir / out_name
+        final_path.write_bytes(data)
+
+        svg_text = None
+        if fmt == "svg":
             try:
-                jpype.attachThreadToJVM()
+                svg_text = data.decode("utf-8", errors="ignore")
             except Exception:
-                pass
+                svg_text = None
+
+        with self._lock:
+            self._cache.set(digest, _CacheEntry(data, svg_text))
+
+        return RenderResult(fmt=fmt, file_path=final_path, bytes_data=data, svg_text=svg_text, cache_key=digest)
+
+    def lookup(
+        self,
+        uml_text: str,
+        fmt: str = "png",
+        dpi: Optional[int] = None,
+        scale: Optional[float] = None,
+        base_dir: Optional[Union[str, Path]] = None,
+    ) -> Optional[RenderResult]:
+        # 只查缓存、不触发JVM渲染；用于判断能否复用已有结果（如由SVG栅格化得到PNG）。
+        # 纯探测：不写输出文件，也不改变缓存的淘汰顺序
+        if fmt not in {"png", "svg"}:
+            return None
+        try:
+            _, digest = self._prepare(uml_text, fmt, dpi, scale, base_dir)
+        except PlantUMLError:
+            return None
+        return self._peek_result(digest, fmt)
+
+    def cache_key(
+        self,
+        uml_text: str,
+        fmt: str = "png",
+        dpi: Optional[int] = None,
+        scale: Optional[float] = None,
+        base_dir: Optional[Union[str, Path]] = None,
+    ) -> Optional[str]:
+        # 与 render 相同的缓存键（含 !include 文件指纹），供调用方索引自己的结果缓存
+        if fmt not in {"png", "svg"}:
+            return None
+        try:
+            return self._prepare(uml_text, fmt, dpi, scale, base_dir)[1]
+        except PlantUMLError:
+            return None
+
+    def get_raster(self, svg_result: RenderResult, dpi: Optional[int], scale: float = 1.0) -> Optional[RenderResult]:
+        if svg_result.fmt != "svg" or svg_result.cache_key is None:
+            return None
+        with self._lock:
+            entry = self._cache.peek(svg_result.cache_key)
+            data = entry.rasters.peek((dpi, scale)) if entry is not None else None
+        if data is None:
+            return None
+        file_path = self._target_dir / _raster_name(svg_result.cache_key, dpi, scale)
+        return RenderResult(fmt="png", file_path=file_path, bytes_data=data)
+
+    def put_raster(self, svg_result: RenderResult, dpi: Optional[int], scale: float, png_bytes: bytes) -> RenderResult:
+        # 栅格化结果挂在对应SVG缓存条目下，随SVG条目一起淘汰
+        if svg_result.cache_key is not None:
+            with self._lock:
+                entry = self._cache.get(svg_result.cache_key)
+                if entry is not None:
+                    entry.rasters.set((dpi, scale), png_bytes)
+        return self._raster_result(svg_result.cache_key or "raster", dpi, scale, png_bytes)
+
+    def _raster_result(self, digest: str, dpi: Optional[int], scale: float, data: bytes) -> RenderResult:
+        final_path = self._target_dir / _raster_name(digest, dpi, scale)
+        try:
+            final_path.write_bytes(data)
+        except Exception:
+            pass
+        return RenderResult(fmt="png", file_path=final_path, bytes_data=data)
+
+    def _prepare(
+        self,
+        uml_text: str,
+        fmt: str,
+        dpi: Optional[int],
+        scale: Optional[float],
+        base_dir: Optional[Union[str, Path]],
+    ) -> tuple[str, str]:
+        # 预先展开本地 !include（相对 base_dir，未指定时与PlantUML一致使用当前目录），
+        # 被包含文件内容按 mtime 缓存；未内联的引用以指纹形式计入缓存键
+        base = Path(base_dir) if base_dir is not None else Path.cwd()
+        processed_text, include_fingerprint = self._includes.resolve(uml_text, base)
 
         # 注入质量选项到文本，确保API能统一应用（skinparam dpi、scale）
-        processed_text = uml_text
         inject_lines = []
         if dpi is not None and fmt == "png":
             inject_lines.append(f"skinparam dpi {int(dpi)}")
@@ -97,21 +289,40 @@ class PlantUMLService:
             else:
                 processed_text = "@startuml\n" + "\n".join(inject_lines) + "\n" + processed_text + "\n@enduml"
 
-        key_src = f"{fmt}|{dpi}|{scale}|" + processed_text
+        key_src = f"{fmt}|{dpi}|{scale}|{include_fingerprint}|" + processed_text
         digest = hashlib.sha1(key_src.encode("utf-8")).hexdigest()[:16]
-        cached = None
+        return processed_text, digest
+
+    def _peek_result(self, digest: str, fmt: str) -> Optional[RenderResult]:
+        # file_path 仅指明渲染时使用的文件名，文件本身可能尚未（或已不再）存在
+        with self._lock:
+            cached = self._cache.peek(digest)
+        if cached is None:
+            return None
+        final_path = self._target_dir / f"diagram_{digest}.{fmt}"
+        return RenderResult(fmt=fmt, file_path=final_path, bytes_data=cached.data, svg_text=cached.svg_text, cache_key=digest)
+
+    def _cached_result(self, digest: str, fmt: str) -> Optional[RenderResult]:
         with self._lock:
             cached = self._cache.get(digest)
-        if cached is not None:
-            bytes_data, svg_text_cached = cached
-            out_name = f"diagram_{digest}.{fmt}"
-            final_path = self._target_dir / out_name
+        if cached is None:
+            return None
+        out_name = f"diagram_{digest}.{fmt}"
+        final_path = self._target_dir / out_name
+        try:
+            final_path.write_bytes(cached.data)
+        except Exception:
+            pass
+        return RenderResult(fmt=fmt, file_path=final_path, bytes_data=cached.data, svg_text=cached.svg_text, cache_key=digest)
+
+    def _attach_current_thread(self) -> None:
+        if not jpype.isThreadAttachedToJVM():
             try:
-                final_path.write_bytes(bytes_data)
+                jpype.attachThreadToJVM()
             except Exception:
                 pass
-            return RenderResult(fmt=fmt, file_path=final_path, bytes_data=bytes_data, svg_text=svg_text_cached)
 
+    def _output_image(self, processed_text: str, fmt: str, dpi: Optional[int], scale: Optional[float]) -> bytes:
         reader = self._SourceStringReader(processed_text)
         fmt_enum = self._FileFormat.PNG if fmt == "png" else self._FileFormat.SVG
         option = self._FileFormatOption(fmt_enum)
@@ -137,22 +348,121 @@ class PlantUMLService:
         data = bytes(baos.toByteArray())
         if not data:
             raise PlantUMLError("PlantUML未生成输出，可能为语法错误或不支持的指令")
+        return data
 
-        out_name = f"diagram_{digest}.{fmt}"
-        final_path = self._target_dir / out_name
-        final_path.write_bytes(data)
+    def _render_interruptible(
+        self,
+        processed_text: str,
+        digest: str,
+        fmt: str,
+        dpi: Optional[int],
+        scale: Optional[float],
+        timeout: Optional[float],
+        cancel: Optional[RenderCancelToken],
+    ) -> RenderResult:
+        # 在独立的附加线程中执行 outputImage，调用方线程负责等待、取消与超时。
+        # PlantUML 不检查线程中断，被放弃的渲染仍会跑完：因此同组内必须等上一个
+        # 渲染线程真正结束后才启动新的，避免被取代的编辑叠加占用CPU；其结果照常写入缓存。
+        # 超时只计本次渲染自身的耗时，从取得组槽位后开始计算，排队等待不计入。
+        # 超时的渲染视为挂起并立即让出槽位；被取代的渲染超过其截止时间后同样不再等待
+        group = cancel.group if cancel is not None else None
+        slot = self._acquire_group(group, cancel)
+        slot.timeout = cancel.timeout if cancel is not None and cancel.timeout is not None else timeout
+        if slot.timeout is not None:
+            slot.deadline = time.monotonic() + slot.timeout
 
-        svg_text = None
-        if fmt == "svg":
+        # 等待期间被放弃的渲染可能恰好产出了相同的结果
+        cached = self._cached_result(digest, fmt)
+        if cached is not None:
+            self._release_group(group, slot)
+            slot.finished.set()
+            return cached
+
+        state: dict = {}
+        if cancel is not None:
+            cancel._bind_render(slot)
+
+        def run() -> None:
             try:
-                svg_text = data.decode("utf-8", errors="ignore")
-            except Exception:
-                svg_text = None
+                self._attach_current_thread()
+                state["jthread"] = JClass("java.lang.Thread").currentThread()
+                if cancel is not None:
+                    cancel._bind_thread(state["jthread"])
+                state["result"] = self._store(digest, fmt, self._output_image(processed_text, fmt, dpi, scale))
+            except Exception as e:
+                state["error"] = e
+            finally:
+                self._release_group(group, slot)
+                slot.finished.set()
+                try:
+                    jpype.detachThreadFromJVM()
+                except Exception:
+                    pass
+
+        try:
+            Thread(target=run, name="PlantUMLRender", daemon=True).start()
+        except Exception:
+            self._release_group(group, slot)
+            slot.finished.set()
+            raise
+        while not slot.finished.wait(_CANCEL_POLL_INTERVAL):
+            try:
+                self._check_interrupted(slot, cancel)
+            except PlantUMLTimeout as e:
+                self._release_group(group, slot)
+                self._abandon_render(state, str(e))
+                raise
+            except PlantUMLError as e:
+                self._abandon_render(state, str(e))
+                raise
+
+        error = state.get("error")
+        if error is not None:
+            if isinstance(error, PlantUMLError):
+                raise error
+            raise PlantUMLError(f"PlantUML render error: {error}")
+        return state["result"]
 
+    def _acquire_group(self, group: object, cancel: Optional[RenderCancelToken]) -> _RenderSlot:
+        while True:
+            with self._lock:
+                running = self._inflight.get(group)
+                if running is None or running.overdue():
+                    if running is not None:
+                        self._logger.info("Previous render of the group is overdue, no longer waiting for it")
+                    slot = _RenderSlot()
+                    self._inflight[group] = slot
+                    return slot
+            if not running.finished.wait(_CANCEL_POLL_INTERVAL) and cancel is not None and cancel.cancelled:
+                raise PlantUMLCancelled("渲染已取消")
+
+    def _release_group(self, group: object, slot: _RenderSlot) -> None:
         with self._lock:
-            self._cache.set(digest, (data, svg_text))
+            if self._inflight.get(group) is slot:
+                del self._inflight[group]
+
+    def _check_interrupted(self, slot: _RenderSlot, cancel: Optional[RenderCancelToken]) -> None:
+        if cancel is not None and cancel.cancelled:
+            raise PlantUMLCancelled("渲染已取消")
+        # 截止时间记在槽位上：调用方放弃等待后，同组排队的渲染据此判断其是否挂起。
+        # 运行中超时被调整（如后台任务切换为可见）时取两者中较晚的截止时间
+        if cancel is not None and cancel.timeout is not None and cancel.timeout != slot.timeout:
+            slot.timeout = cancel.timeout
+            if slot.deadline is not None:
+                slot.deadline = max(slot.deadline, time.monotonic() + slot.timeout)
+        if slot.overdue():
+            raise PlantUMLTimeout(f"渲染超时（{slot.timeout:g} 秒）")
 
-        return RenderResult(fmt=fmt, file_path=final_path, bytes_data=data, svg_text=svg_text)
+    def _abandon_render(self, state: dict, reason: str) -> None:
+        jthread = state.get("jthread")
+        self._logger.info("Render abandoned (%s), result will still be cached when it finishes", reason)
+        if jthread is None:
+            return
+        try:
+            # 尽力而为：PlantUML 的布局代码基本不响应中断
+            jthread.interrupt()
+        except Exception as e:
+            self._logger.warning("Failed to interrupt render thread: %s", e)
 
     def shutdown(self) -> None:
         try:
@@ -169,6 +479,29 @@ class PlantUMLService:
             os._exit(0)
 
 
+@dataclass
+class _RenderSlot:
+    # 组内渲染槽位：finished 在JVM渲染线程真正结束时置位；deadline 为单调时钟截止时间
+    finished: Event = field(default_factory=Event)
+    timeout: Optional[float] = None
+    deadline: Optional[float] = None
+
+    def overdue(self) -> bool:
+        return self.deadline is not None and not self.finished.is_set() and time.monotonic() >= self.deadline
+
+
+@dataclass
+class _CacheEntry:
+    data: bytes
+    svg_text: Optional[str]
+    # SVG条目的栅格化PNG：(dpi, scale) -> bytes
+    rasters: "_LRUCache" = field(default_factory=lambda: _LRUCache(4))
+
+
+def _raster_name(digest: str, dpi: Optional[int], scale: float) -> str:
+    return f"diagram_{digest}_{dpi or 96}dpi_{scale:g}x.png"
+
+
 class _LRUCache:
     def __init__(self, maxsize: int = 32):
         self._maxsize = maxsize
@@ -181,6 +514,10 @@ class _LRUCache:
             return value
         return None
 
+    def peek(self, key):
+        # 只读访问：不调整淘汰顺序
+        return self._data.get(key)
+
     def set(self, key, value):
         if key in self._data:
             self._data.pop(key)
@@ -189,3 +526,141 @@ class _LRUCache:
                 self._data.popitem(last=False)
         self._data[key] = value
 
+
+
+@dataclass
+class _IncludedFile:
+    mtime_ns: int
+    size: int
+    text: str
+
+
+class _IncludeResolver:
+    # 匹配 !include / !include_many / !include_once / !includesub 指令
+    _DIRECTIVE = re.compile(r"^(\s*)!(include|include_many|include_once|includesub)\s+(.+?)\s*$")
+    _START = re.compile(r"^\s*@start\w*")
+    _END = re.compile(r"^\s*@end\w*")
+    # 预处理器块：其中的指令是否执行取决于条件或调用，不能在此静态展开
+    _BLOCK_OPEN = re.compile(r"^\s*!(?:if|ifdef|ifndef|while|foreach|(?:unquoted\s+)?(?:procedure|function))\b")
+    _BLOCK_CLOSE = re.compile(r"^\s*!(?:endif|endwhile|endfor|end\s*procedure|end\s*function)\b")
+
+    def __init__(self, maxsize: int = 256, max_depth: int = 16):
+        self._files = _LRUCache(maxsize)
+        self._max_depth = max_depth
+        self._lock = RLock()
+
+    def resolve(self, text: str, base_dir: Path) -> tuple[str, str]:
+        # 在条件/过程块中出现过、或被 !include_once 引用的文件（deferred）一律不内联，
+        # 全部改写为绝对路径交给 PlantUML，由其按实际分支与 include-once 语义处理。
+        # 展开过程中新发现此类文件时，之前可能已内联过它，按更新后的集合重新展开
+        deferred: set = set()
+        while True:
+            known = len(deferred)
+            deps: list[str] = []
+            lines = self._expand(text, base_dir, (), set(), deps, deferred, False)
+            if len(deferred) == known:
+                return "\n".join(lines), ";".join(deps)
+
+    def _expand(self, text: str, base_dir: Path, stack: tuple, once: set, deps: list, deferred: set, guarded: bool) -> list[str]:
+        out = []
+        depth = 0
+        in_comment = False
+        for line in text.splitlines():
+            commented = in_comment
+            in_comment = self._comment_state(line, in_comment)
+            m = None if commented else self._DIRECTIVE.match(line)
+            if not m:
+                if not commented:
+                    depth = self._block_depth(line, depth)
+                out.append(line)
+                continue
+            indent, directive, target = m.groups()
+            target = target.strip().strip('"')
+            # 标准库 <C4/...> 由 PlantUML 从 jar 内读取并自行缓存；URL 与含变量的路径交给 PlantUML
+            if target.startswith("<") or "://" in target or "$" in target or "%" in target:
+                out.append(line)
+                continue
+            path_part, sep, block = target.partition("!")
+            path = Path(path_part)
+            if not path.is_absolute():
+                path = base_dir / path
+            try:
+                path = path.resolve()
+            except Exception:
+                out.append(line)
+                continue
+            entry = self._load(path)
+            if entry is None:
+                # 文件不存在或不可读：保留原指令，由 PlantUML 生成错误信息
+                out.append(line)
+                continue
+            dep = f"{path}:{entry.mtime_ns}:{entry.size}"
+            new_dep = dep not in deps
+            if new_dep:
+                deps.append(dep)
+            if guarded or depth > 0 or directive == "include_once":
+                deferred.add(path)
+            if directive == "includesub" or sep or path in deferred:
+                # 不内联，改写为绝对路径即可脱离工作目录解析；仍遍历其内容，
+                # 使其中再包含的文件计入依赖指纹
+                out.append(f"{indent}!{directive} {path}{sep}{block}")
+                if new_dep and path not in stack and len(stack) < self._max_depth:
+                    self._expand(self._body(entry.text), path.parent, stack + (path,), set(), deps, deferred, True)
+                continue
+            # 与 PlantUML 一致：!include 同一文件只包含一次，重复时忽略；只有 !include_many 才会重复包含
+            if directive == "include" and path in once:
+                continue
+            if path in stack or len(stack) >= self._max_depth:
+                # !include_many 形成循环时不再展开，交给 PlantUML 处理
+                out.append(f"{indent}!{directive} {path}")
+                continue
+            once.add(path)
+            out.extend(self._expand(self._body(entry.text), path.parent, stack + (path,), once, deps, deferred, False))
+        return out
+
+    @staticmethod
+    def _comment_state(line: str, in_comment: bool) -> bool:
+        # 按行跟踪 /' ... '/ 块注释，返回该行结束时是否仍处于注释中
+        i = 0
+        while True:
+            j = line.find("'/" if in_comment else "/'", i)
+            if j < 0:
+                return in_comment
+            in_comment = not in_comment
+            i = j + 2
+
+    def _block_depth(self, line: str, depth: int) -> int:
+        # 单行函数（!function ... !return ...）没有对应的结束指令
+        if self._BLOCK_OPEN.match(line) and "!return" not in line:
+            return depth + 1
+        if self._BLOCK_CLOSE.match(line):
+            return max(0, depth - 1)
+        return depth
+
+    def _body(self, text: str) -> str:
+        # 与 PlantUML 一致：被包含文件若含 @startuml/@enduml，仅取第一个块的内容
+        lines = text.splitlines()
+        start = next((i for i, l in enumerate(lines) if self._START.match(l)), None)
+        if start is None:
+            return text
+        end = next((i for i in range(start + 1, len(lines)) if self._END.match(lines[i])), len(lines))
+        return "\n".join(lines[start + 1:end])
+
+    def _load(self, path: Path) -> Optional[_IncludedFile]:
+        try:
+            st = path.stat()
+        except OSError:
+            return None
+        key = str(path)
+        with self._lock:
+            entry = self._files.get(key)
+        if entry is not None and entry.mtime_ns == st.st_mtime_ns and entry.size == st.st_size:
+            return entry
+        try:
+            text = path.read_text(encoding="utf-8", errors="replace")
+        except OSError:
+            return None
+        entry = _IncludedFile(mtime_ns=st.st_mtime_ns, size=st.st_size, text=text)
+        with self._lock:
+            self._files.set(key, entry)
+        return entry
@@ -0,0 +1,471 @@
+from __future__ import annotations
+
+import logging
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+from PyQt6.QtCore import Qt, QTimer, pyqtSignal, QEvent, QMimeData, QSize
+from PyQt6.QtGui import QIcon, QImage, QPixmap, QTextCursor
+from PyQt6.QtWidgets import (
+    QApplication,
+    QFileDialog,
+    QLabel,
+    QListView,
+    QListWidget,
+    QListWidgetItem,
+    QMessageBox,
+    QPlainTextEdit,
+    QProgressBar,
+    QScrollArea,
+    QSplitter,
+    QStackedWidget,
+    QVBoxLayout,
+    QWidget,
+)
+
+try:
+    from PyQt6.QtSvgWidgets import QSvgWidget  # type: ignore
+    SVG_WIDGET_AVAILABLE = True
+except Exception:
+    SVG_WIDGET_AVAILABLE = False
+
+from services.plantuml_service import PlantUMLError, PlantUMLService, RenderResult
+from ui.render_history import HistoryEntry, RenderHistory
+from ui.render_scheduler import SVG_RENDERER_AVAILABLE, THUMBNAIL_SIZE, RenderScheduler
+try:
+    from utils.config import EXPORT_RENDER_TIMEOUT, HISTORY_MAX_ENTRIES, HISTORY_MAX_BYTES
+except Exception:
+    EXPORT_RENDER_TIMEOUT = 120.0
+    HISTORY_MAX_ENTRIES = 20
+    HISTORY_MAX_BYTES = 64 * 1024 * 1024
+
+
+class DocumentTab(QWidget):
+    # 单个文档：编辑器、预览与历史；渲染通过共享的 RenderScheduler 排队执行
+    status_message = pyqtSignal(str, int)
+    title_changed = pyqtSignal(str)
+
+    def __init__(
+        self,
+        service: PlantUMLService,
+        scheduler: RenderScheduler,
+        options_provider: Callable[[], tuple[str, dict]],
+        title: str,
+        parent: Optional[QWidget] = None,
+    ):
+        super().__init__(parent)
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self.service = service
+        self._scheduler = scheduler
+        self._options_provider = options_provider
+        self._untitled = title
+        self.current_result: Optional[RenderResult] = None
+        # 当前打开的文件，其所在目录作为 !include 相对路径的基准
+        self.current_file: Optional[Path] = None
+        # 最近渲染结果环：撤销/重做回到已渲染过的状态时直接切换预览
+        self._history = RenderHistory(HISTORY_MAX_ENTRIES, HISTORY_MAX_BYTES)
+        # 复制序号：只有最近一次复制的栅格化结果才写入剪贴板
+        self._copy_seq = 0
+
+        self.editor = QPlainTextEdit()
+        self.editor.setPlaceholderText("在此输入/编辑PlantUML代码，例如:\n@startuml\nAlice -> Bob: Hello\n@enduml")
+
+        # PNG 预览滚动容器与标签
+        self.png_label = QLabel()
+        self.png_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.png_scroll = QScrollArea()
+        self.png_scroll.setWidgetResizable(True) # 允许内容自适应，但我们会手动调整 label 大小
+        self.png_scroll.setWidget(self.png_label)
+        self.png_scroll.setAlignment(Qt.AlignmentFlag.AlignCenter) # 让内容居中
+
+        # SVG 预览滚动容器与部件
+        self.svg_widget = QSvgWidget() if SVG_WIDGET_AVAILABLE else None
+        self.svg_scroll = QScrollArea()
+        self.svg_scroll.setWidgetResizable(True)
+        if self.svg_widget:
+            self.svg_scroll.setWidget(self.svg_widget)
+            self.svg_scroll.setAlignment(Qt.AlignmentFlag.AlignCenter)
+
+        splitter = QSplitter(Qt.Orientation.Horizontal)
+        splitter.setHandleWidth(1) # 由 QSS 控制外观，这里设个小值
+        splitter.setChildrenCollapsible(False)
+
+        editor_container = QWidget()
+        editor_layout = QVBoxLayout(editor_container)
+        editor_layout.setContentsMargins(0, 0, 0, 0)
+        editor_layout.addWidget(self.editor)
+        splitter.addWidget(editor_container)
+
+        # 预览栈：占位页、加载页、预览页
+        self.preview_stack = QStackedWidget()
+        self.page_placeholder = QLabel("欢迎使用：在左侧输入PlantUML代码，右侧实时预览")
+        self.page_placeholder.setObjectName("previewPlaceholder")
+        self.page_placeholder.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.page_error = QLabel("")
+        self.page_error.setObjectName("errorLabel")
+        self.page_error.setWordWrap(True)
+        self.page_error.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.page_loading = QWidget()
+        self.page_loading.setObjectName("previewLoading")
+        loading_layout = QVBoxLayout(self.page_loading)
+        loading_layout.setContentsMargins(20, 20, 20, 20)
+        self.loading_label = QLabel("正在加载资源…")
+        self.loading_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.loading_bar = QProgressBar()
+        self.loading_bar.setRange(0, 0)  # 不确定进度，显示动画
+        loading_layout.addStretch(1)
+        loading_layout.addWidget(self.loading_label)
+        loading_layout.addWidget(self.loading_bar)
+        loading_layout.addStretch(1)
+
+        # 预览页根据可用性添加
+        self.page_png = self.png_scroll
+        self.page_svg = self.svg_scroll if self.svg_widget else QWidget()
+
+        self.preview_stack.addWidget(self.page_placeholder)
+        self.preview_stack.addWidget(self.page_loading)
+        self.preview_stack.addWidget(self.page_error)
+        self.preview_stack.addWidget(self.page_png)
+        self.preview_stack.addWidget(self.page_svg)
+
+        # 历史缩略图条：显示最近版本，点击恢复对应文本
+        self.history_strip = QListWidget()
+        self.history_strip.setObjectName("historyStrip")
+        self.history_strip.setViewMode(QListView.ViewMode.IconMode)
+        self.history_strip.setFlow(QListView.Flow.LeftToRight)
+        self.history_strip.setWrapping(False)
+        self.history_strip.setMovement(QListView.Movement.Static)
+        self.history_strip.setIconSize(QSize(THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        self.history_strip.setFixedHeight(THUMBNAIL_SIZE + 24)
+        self.history_strip.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAsNeeded)
+        self.history_strip.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        self.history_strip.itemClicked.connect(self._on_history_item_clicked)
+
+        preview_container = QWidget()
+        preview_layout = QVBoxLayout(preview_container)
+        preview_layout.setContentsMargins(0, 0, 0, 0)
+        preview_layout.setSpacing(0)
+        preview_layout.addWidget(self.preview_stack)
+        preview_layout.addWidget(self.history_strip)
+
+        splitter.addWidget(preview_container)
+        splitter.setStretchFactor(0, 1)
+        splitter.setStretchFactor(1, 1)
+
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.setSpacing(0)
+        layout.addWidget(splitter)
+
+        self.editor.textChanged.connect(self._on_text_changed)
+        self._debounce = QTimer(self)
+        self._debounce.setSingleShot(True)
+        self._debounce.timeout.connect(self.render_preview)
+
+        # 安装滚轮事件过滤器
+        self.png_scroll.viewport().installEventFilter(self)
+        if self.svg_widget:
+            self.svg_scroll.viewport().installEventFilter(self)
+        self._zoom = 1.0
+        self._original_pixmap = None
+        self._base_size_png = None
+        self._base_size_svg = None
+        self._last_convert_ms = 0.0
+
+    @property
+    def title(self) -> str:
+        return self.current_file.name if self.current_file else self._untitled
+
+    def is_rendering(self) -> bool:
+        return self._scheduler.is_busy(self)
+
+    def _on_text_changed(self) -> None:
+        # 撤销/重做等回到已渲染过的状态时，从历史环中立即切换预览，无需重新渲染
+        if self._show_from_history():
+            self._debounce.stop()
+            return
+        self._debounce.start(500)
+
+    def render_preview(self, use_history: bool = True) -> None:
+        # use_history=False：显式“渲染”操作绕过历史环，总是经由服务重新检查缓存
+        text = self.editor.toPlainText().strip()
+        if not text:
+            # 空内容不渲染，显示占位
+            self.preview_stack.setCurrentWidget(self.page_placeholder)
+            return
+        if not self._is_puml_text(text):
+            self.page_error.setText("当前文本不是有效的PlantUML描述，已跳过渲染")
+            self.preview_stack.setCurrentWidget(self.page_error)
+            return
+        if use_history and self._show_from_history():
+            return
+        preview_fmt, opts, request = self._preview_request(text)
+        self._logger.info("Render preview requested: fmt=%s opts=%s", preview_fmt, opts)
+
+        render_text = request[0]
+
+        # 显示加载页，异步渲染；同一文档的新请求会取代正在进行的任务
+        self.preview_stack.setCurrentWidget(self.page_loading)
+        source_text = self.editor.toPlainText()
+        undo_steps = self.editor.document().availableUndoSteps()
+        self._scheduler.submit(
+            self,
+            render_text,
+            preview_fmt,
+            opts.get("dpi"),
+            opts.get("scale"),
+            self.base_dir(),
+            lambda result, image, thumbnail: self._on_render_done(request, source_text, undo_steps, result, image, thumbnail),
+            self._on_render_error,
+        )
+
+    def _render_text(self, text: str) -> str:
+        # 自动包裹 @startuml/@enduml，避免用户忘记标记导致渲染异常；预览与导出共用，保证缓存键一致
+        if "@startuml" not in text:
+            return f"@startuml\n{text}\n@enduml"
+        return text
+
+    def _preview_request(self, text: str) -> tuple[str, dict, tuple]:
+        fmt, opts = self._options_provider()
+        # 无 QSvgWidget 时，若有 QSvgRenderer 则在工作线程栅格化 SVG 预览，否则回退为 PNG
+        preview_fmt = fmt if not (fmt == "svg" and not (SVG_WIDGET_AVAILABLE or SVG_RENDERER_AVAILABLE)) else "png"
+        # 请求键只含文本与选项，每次按键都会计算，不做 !include 解析与哈希
+        request = (self._render_text(text), preview_fmt, opts.get("dpi"), opts.get("scale"), self.base_dir())
+        return preview_fmt, opts, request
+
+    def _show_from_history(self) -> bool:
+        text = self.editor.toPlainText().strip()
+        if not text:
+            return False
+        preview_fmt, opts, request = self._preview_request(text)
+        entry = self._history.find(request)
+        if entry is None:
+            return False
+        # 命中后才计算含 !include 文件指纹的缓存键，被包含文件已变化时不使用历史
+        key = self.service.cache_key(request[0], preview_fmt, opts.get("dpi"), opts.get("scale"), self.base_dir())
+        if key != entry.key:
+            return False
+        self._scheduler.cancel(self)
+        self._display_result(entry.result, entry.image)
+        self._refresh_history_strip(key)
+        self.status_message.emit(f"已从历史恢复预览（撤销步骤 {entry.undo_steps}）", 1500)
+        return True
+
+    def _refresh_history_strip(self, current_key: Optional[str] = None) -> None:
+        self.history_strip.clear()
+        for entry in reversed(self._history.entries()):
+            item = QListWidgetItem()
+            if entry.thumbnail is not None and not entry.thumbnail.isNull():
+                item.setIcon(QIcon(QPixmap.fromImage(entry.thumbnail)))
+            else:
+                item.setText(entry.result.fmt.upper())
+            item.setToolTip(f"{time.strftime('%H:%M:%S', time.localtime(entry.created_at))} · 撤销步骤 {entry.undo_steps}")
+            item.setData(Qt.ItemDataRole.UserRole, entry.key)
+            self.history_strip.addItem(item)
+            if entry.key == current_key:
+                item.setSelected(True)
+
+    def _on_history_item_clicked(self, item: QListWidgetItem) -> None:
+        entry = self._history.get(item.data(Qt.ItemDataRole.UserRole))
+        if entry is None or entry.source_text == self.editor.toPlainText():
+            return
+        # 通过光标整体替换文本，保留撤销栈；随后 textChanged 会命中历史并立即切换预览
+        cursor = self.editor.textCursor()
+        cursor.select(QTextCursor.SelectionType.Document)
+        cursor.insertText(entry.source_text)
+
+    def save_output(self) -> None:
+        text = self.editor.toPlainText().strip()
+        if not text:
+            QMessageBox.information(self, "提示", "请先输入PlantUML代码")
+            return
+        fmt, opts = self._options_provider()
+        render_text = self._render_text(text)
+        self._logger.info("Save output requested: fmt=%s opts=%s", fmt, opts)
+        # 导出始终使用PlantUML原生输出（含嵌入的源码元数据）；SVG栅格化只用于预览与剪贴板
+        try:
+            result = self.service.render(render_text, fmt=fmt, dpi=opts.get("dpi"), scale=opts.get("scale"), timeout=EXPORT_RENDER_TIMEOUT, base_dir=self.base_dir())
+        except PlantUMLError as e:
+            QMessageBox.critical(self, "保存错误", str(e))
+            return
+        suffix = ".png" if fmt == "png" else ".svg"
+        default_name = f"{self.current_file.stem if self.current_file else 'diagram'}{suffix}"
+        fn, _ = QFileDialog.getSaveFileName(self, "保存输出", default_name, f"*.{fmt}")
+        if fn:
+            try:
+                Path(fn).write_bytes(result.bytes_data)
+                self.status_message.emit(f"已保存: {fn}", 3000)
+            except OSError as e:
+                QMessageBox.critical(self, "保存错误", str(e))
+
+    def base_dir(self) -> Optional[Path]:
+        return self.current_file.parent if self.current_file else None
+
+    def _on_render_done(self, request: tuple, source_text: str, undo_steps: int, result: RenderResult, image: object, thumbnail: object) -> None:
+        # 历史键取自服务的渲染缓存键（在工作线程中算出），包含被 !include 文件的指纹
+        key = result.cache_key
+        if key is not None:
+            self._history.add(HistoryEntry(
+                key=key,
+                request=request,
+                source_text=source_text,
+                undo_steps=undo_steps,
+                result=result,
+                image=image if isinstance(image, QImage) else None,
+                thumbnail=thumbnail if isinstance(thumbnail, QImage) else None,
+            ))
+            self._refresh_history_strip(key)
+        self._display_result(result, image)
+
+    def _display_result(self, result: RenderResult, image: object) -> None:
+        self.current_result = result
+        decoded = isinstance(image, QImage) and not image.isNull()
+        # 工作线程未栅格化的（较小的）SVG 才由矢量部件加载
+        if result.fmt == "svg" and self.svg_widget and not decoded:
+            try:
+                self.svg_widget.load(result.bytes_data)
+                self._original_pixmap = None
+                # 记录基础尺寸并应用缩放
+                try:
+                    renderer = self.svg_widget.renderer()
+                    self._base_size_svg = renderer.defaultSize()
+                except Exception:
+                    self._base_size_svg = None
+                self._zoom = 1.0
+                if self._base_size_svg:
+                    self.svg_widget.resize(int(self._base_size_svg.width() * self._zoom), int(self._base_size_svg.height() * self._zoom))
+                self.preview_stack.setCurrentWidget(self.page_svg)
+                self.status_message.emit("渲染成功", 2000)
+                return
+            except Exception:
+                pass
+        # 工作线程已解码/栅格化为 QImage，这里只做廉价的 QPixmap 转换
+        if decoded:
+            t0 = time.perf_counter()
+            pix = QPixmap.fromImage(image)
+            self._last_convert_ms = (time.perf_counter() - t0) * 1000.0
+            self._logger.info("Preview pixmap conversion: %.2f ms (%dx%d)", self._last_convert_ms, pix.width(), pix.height())
+            self._original_pixmap = pix
+            self._base_size_png = pix.size()
+            self._zoom = 1.0
+            scaled = self._original_pixmap.scaled(self._base_size_png * self._zoom, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
+            self.png_label.setPixmap(scaled)
+            self.png_label.resize(scaled.size())
+            self.preview_stack.setCurrentWidget(self.page_png)
+        else:
+            self._original_pixmap = None
+            self.preview_stack.setCurrentWidget(self.page_placeholder)
+        self.status_message.emit("渲染成功", 2000)
+
+    def _on_render_error(self, msg: str) -> None:
+        self.page_error.setText(f"渲染错误：\n{msg}")
+        self.preview_stack.setCurrentWidget(self.page_error)
+        self.status_message.emit("渲染失败", 3000)
+
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Type.Wheel and (obj is self.png_scroll.viewport() or obj is (self.svg_scroll.viewport() if self.svg_widget else None)):
+            delta = event.angleDelta().y()
+            step = 1.1 if delta > 0 else 1/1.1
+            new_zoom = max(0.25, min(6.0, self._zoom * step))
+            if abs(new_zoom - self._zoom) > 1e-3:
+                self._zoom = new_zoom
+                self._apply_zoom()
+                self.status_message.emit(f"缩放 {int(self._zoom * 100)}%", 800)
+            return True
+        return super().eventFilter(obj, event)
+
+    def _apply_zoom(self) -> None:
+        if not self.current_result:
+            return
+        if self._original_pixmap and self._base_size_png:
+            scaled = self._original_pixmap.scaled(self._base_size_png * self._zoom, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
+            self.png_label.setPixmap(scaled)
+            self.png_label.resize(scaled.size())
+            self.preview_stack.setCurrentWidget(self.page_png)
+        elif self.current_result.fmt == "svg" and self.svg_widget and self._base_size_svg:
+            self.svg_widget.resize(int(self._base_size_svg.width() * self._zoom), int(self._base_size_svg.height() * self._zoom))
+            self.preview_stack.setCurrentWidget(self.page_svg)
+
+    def copy_to_clipboard(self) -> None:
+        if not self.current_result:
+            QMessageBox.information(self, "提示", "请先渲染以生成预览")
+            return
+        cb = QApplication.clipboard()
+        self._copy_seq += 1
+        if self.current_result.fmt == "png":
+            # 预览已解码的位图直接复用，避免在GUI线程重复解码
+            pix = self._original_pixmap
+            if pix is None or pix.isNull():
+                pix = QPixmap()
+                pix.loadFromData(self.current_result.bytes_data)
+            cb.setPixmap(pix)
+            self.status_message.emit("PNG已复制到剪贴板", 2000)
+            return
+        # SVG：先复制文本，再在后台按当前DPI栅格化（结果缓存在SVG条目旁），完成后同时提供图像与文本
+        svg_result = self.current_result
+        if svg_result.svg_text:
+            cb.setText(svg_result.svg_text)
+        if not SVG_RENDERER_AVAILABLE:
+            self.status_message.emit("已复制SVG文本到剪贴板", 2000)
+            return
+        _, opts = self._options_provider()
+        self.status_message.emit("已复制SVG文本，正在生成图像…", 2000)
+        seq = self._copy_seq
+        self._scheduler.rasterize(
+            self,
+            svg_result,
+            opts.get("raster_dpi"),
+            1.0,
+            lambda _result, image: self._set_clipboard_image(seq, svg_result, image),
+            lambda _msg: self.status_message.emit("已复制SVG文本到剪贴板", 2000),
+        )
+
+    def _set_clipboard_image(self, seq: int, svg_result: RenderResult, image: object) -> None:
+        if not isinstance(image, QImage) or image.isNull():
+            return
+        # 之后又有复制操作，或剪贴板已被其他内容替换时，丢弃过期结果
+        if seq != self._copy_seq:
+            return
+        if svg_result.svg_text and QApplication.clipboard().text() != svg_result.svg_text:
+            return
+        mime = QMimeData()
+        if svg_result.svg_text:
+            mime.setText(svg_result.svg_text)
+        mime.setImageData(image)
+        QApplication.clipboard().setMimeData(mime)
+        self.status_message.emit("SVG图像/文本已复制到剪贴板", 2000)
+
+    def load_file(self, path: Path) -> None:
+        content = path.read_text(encoding="utf-8")
+        self.current_file = path
+        self.editor.setPlainText(content)
+        self.title_changed.emit(self.title)
+
+    def is_pristine(self) -> bool:
+        # 未关联文件且未编辑过的空白文档，可被“打开”直接复用
+        return self.current_file is None and not self.editor.document().isUndoAvailable()
+
+    def show_loading(self, value: int, text: str) -> None:
+        self.loading_bar.setRange(0, 100)
+        self.loading_bar.setValue(value)
+        self.loading_label.setText(text)
+        self.preview_stack.setCurrentWidget(self.page_loading)
+
+    def show_placeholder(self) -> None:
+        self.loading_bar.setRange(0, 0)
+        self.preview_stack.setCurrentWidget(self.page_placeholder)
+
+    def shutdown(self) -> None:
+        self._debounce.stop()
+        self._scheduler.forget(self)
+
+    def _is_puml_text(self, text: str) -> bool:
+        t = text.strip()
+        if not t:
+            return False
+        if "@startuml" in t and "@enduml" in t:
+            return True
+        # 简单启发式：包含关系箭头或skinparam等关键字时认为是PUML
+        keywords = ["->", "-->", "skinparam", "class ", "actor ", "usecase ", "rectangle ", "interface ", "note ", "partition "]
+        return any(k in t for k in keywords)
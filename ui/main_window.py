@@ -3,8 +3,8 @@ from __future__ import annotations
 from pathlib import Path
 from typing import Optional
 
-from PyQt6.QtCore import Qt, QTimer, pyqtSignal, QThread, QEvent
-from PyQt6.QtGui import QAction, QCloseEvent, QIcon, QPixmap
+from PyQt6.QtCore import Qt, QTimer, pyqtSignal, QThread
+from PyQt6.QtGui import QAction, QCloseEvent
 from PyQt6.QtWidgets import (
     QApplication,
     QFileDialog,
@@ -12,33 +12,25 @@ from PyQt6.QtWidgets import (
     QLabel,
     QMainWindow,
     QMessageBox,
-    QPlainTextEdit,
     QPushButton,
     QSizePolicy,
     QSpinBox,
-    QSplitter,
     QStatusBar,
-    QToolBar,
+    QTabWidget,
+    QToolButton,
     QVBoxLayout,
     QWidget,
     QComboBox,
-    QStackedWidget,
-    QProgressBar,
-    QScrollArea,
 )
 
-try:
-    from PyQt6.QtSvgWidgets import QSvgWidget  # type: ignore
-    SVG_WIDGET_AVAILABLE = True
-except Exception:
-    SVG_WIDGET_AVAILABLE = False
-
-from services.plantuml_service import PlantUMLService, PlantUMLError, RenderResult
+from services.plantuml_service import PlantUMLService
+from ui.document_tab import DocumentTab
+from ui.render_scheduler import RenderScheduler
 import logging
 
 
 class MainWindow(QMainWindow):
-    def __init__(self, jar_path: str):
+    def __init__(self, service: PlantUMLService):
         super().__init__()
         self.setWindowTitle("PlanUML 图形化工具")
         self.resize(1100, 700)
@@ -46,74 +38,24 @@ class MainWindow(QMainWindow):
         self._logger = logging.getLogger(self.__class__.__name__)
         self._load_style()
 
-        self.service = PlantUMLService(jar_path)
-        self.current_result: Optional[RenderResult] = None
-        self._render_worker: Optional[_RenderWorker] = None
-
-        self.editor = QPlainTextEdit()
-        self.editor.setPlaceholderText("在此输入/编辑PlantUML代码，例如:\n@startuml\nAlice -> Bob: Hello\n@enduml")
-
-        # PNG 预览滚动容器与标签
-        self.png_label = QLabel()
-        self.png_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        self.png_scroll = QScrollArea()
-        self.png_scroll.setWidgetResizable(True) # 允许内容自适应，但我们会手动调整 label 大小
-        self.png_scroll.setWidget(self.png_label)
-        self.png_scroll.setAlignment(Qt.AlignmentFlag.AlignCenter) # 让内容居中
-
-        # SVG 预览滚动容器与部件
-        self.svg_widget = QSvgWidget() if SVG_WIDGET_AVAILABLE else None
-        self.svg_scroll = QScrollArea()
-        self.svg_scroll.setWidgetResizable(True)
-        if self.svg_widget:
-            self.svg_scroll.setWidget(self.svg_widget)
-            self.svg_scroll.setAlignment(Qt.AlignmentFlag.AlignCenter)
-
-        splitter = QSplitter(Qt.Orientation.Horizontal)
-        splitter.setHandleWidth(1) # 由 QSS 控制外观，这里设个小值
-        splitter.setChildrenCollapsible(False)
-        
-        editor_container = QWidget()
-        editor_layout = QVBoxLayout(editor_container)
-        editor_layout.setContentsMargins(0, 0, 0, 0)
-        editor_layout.addWidget(self.editor)
-        splitter.addWidget(editor_container)
-
-        # 预览栈：占位页、加载页、预览页
-        self.preview_stack = QStackedWidget()
-        self.page_placeholder = QLabel("欢迎使用：在左侧输入PlantUML代码，右侧实时预览")
-        self.page_placeholder.setObjectName("previewPlaceholder")
-        self.page_placeholder.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        self.page_error = QLabel("")
-        self.page_error.setObjectName("errorLabel")
-        self.page_error.setWordWrap(True)
-        self.page_error.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        self.page_loading = QWidget()
-        self.page_loading.setObjectName("previewLoading")
-        loading_layout = QVBoxLayout(self.page_loading)
-        loading_layout.setContentsMargins(20, 20, 20, 20)
-        self.loading_label = QLabel("正在加载资源…")
-        self.loading_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        self.loading_bar = QProgressBar()
-        self.loading_bar.setRange(0, 0)  # 不确定进度，显示动画
-        loading_layout.addStretch(1)
-        loading_layout.addWidget(self.loading_label)
-        loading_layout.addWidget(self.loading_bar)
-        loading_layout.addStretch(1)
-
-        # 预览页根据可用性添加
-        self.page_png = self.png_scroll
-        self.page_svg = self.svg_scroll if self.svg_widget else QWidget()
-
-        self.preview_stack.addWidget(self.page_placeholder)
-        self.preview_stack.addWidget(self.page_loading)
-        self.preview_stack.addWidget(self.page_error)
-        self.preview_stack.addWidget(self.page_png)
-        self.preview_stack.addWidget(self.page_svg)
-
-        splitter.addWidget(self.preview_stack)
-        splitter.setStretchFactor(0, 1)
-        splitter.setStretchFactor(1, 1)
+        # 所有标签页共享同一个服务（JVM 与渲染缓存）和同一个渲染调度器
+        self.service = service
+        self.scheduler = RenderScheduler(service, parent=self)
+        self._untitled_counter = 0
+        self._engine_ready = False
+
+        self.tabs = QTabWidget()
+        self.tabs.setObjectName("documentTabs")
+        self.tabs.setDocumentMode(True)
+        self.tabs.setTabsClosable(True)
+        self.tabs.setMovable(True)
+        self.tabs.tabCloseRequested.connect(self._close_tab)
+        self.tabs.currentChanged.connect(self._on_current_tab_changed)
+        new_tab_btn = QToolButton()
+        new_tab_btn.setText("+")
+        new_tab_btn.setToolTip("新建标签页 (Ctrl+N)")
+        new_tab_btn.clicked.connect(self.new_tab)
+        self.tabs.setCornerWidget(new_tab_btn, Qt.Corner.TopRightCorner)
 
         # 底部固定控制栏
         bottom_bar = QWidget()
@@ -191,36 +133,46 @@ class MainWindow(QMainWindow):
         copy_btn.setMaximumWidth(80)
         bottom_layout.addWidget(copy_btn)
 
+
         central = QWidget()
         layout = QVBoxLayout(central)
         layout.setContentsMargins(0, 0, 0, 0)
         layout.setSpacing(0)
-        layout.addWidget(splitter)
+        layout.addWidget(self.tabs)
         layout.addWidget(bottom_bar)
         self.setCentralWidget(central)
 
         self.status = QStatusBar()
         self.setStatusBar(self.status)
 
-        self.editor.textChanged.connect(self._on_text_changed)
-        self._debounce = QTimer(self)
-        self._debounce.setSingleShot(True)
-        self._debounce.timeout.connect(self.render_preview)
+        # 菜单栏隐藏，快捷键直接挂在窗口上
+        act_new = QAction("新建", self)
+        act_new.setShortcut("Ctrl+N")
+        act_new.triggered.connect(self.new_tab)
+        self.addAction(act_new)
+
+        act_open = QAction("打开", self)
+        act_open.setShortcut("Ctrl+O")
+        act_open.triggered.connect(self._open_file)
+        self.addAction(act_open)
+
+        act_close = QAction("关闭标签页", self)
+        act_close.setShortcut("Ctrl+W")
+        act_close.triggered.connect(lambda: self._close_tab(self.tabs.currentIndex()))
+        self.addAction(act_close)
 
         self.menuBar().setVisible(False)
+        self.new_tab()
         self._start_resource_loading()
-        # 安装滚轮事件过滤器
-        self.png_scroll.viewport().installEventFilter(self)
-        if self.svg_widget:
-            self.svg_scroll.viewport().installEventFilter(self)
-        self._zoom = 1.0
-        self._original_pixmap = None
-        self._base_size_png = None
-        self._base_size_svg = None
 
     def _init_menu(self) -> None:
         file_menu = self.menuBar().addMenu("文件")
 
+        act_new = QAction("新建", self)
+        act_new.setShortcut("Ctrl+N")
+        act_new.triggered.connect(self.new_tab)
+        file_menu.addAction(act_new)
+
         act_open = QAction("打开", self)
         act_open.setShortcut("Ctrl+O")
         act_open.triggered.connect(self._open_file)
@@ -278,175 +230,104 @@ class MainWindow(QMainWindow):
         self.dpi_spin.blockSignals(False)
         self.scale_spin.blockSignals(False)
 
-    def _on_text_changed(self) -> None:
-        self._debounce.start(500)
-
     def _get_quality_options(self, fmt: str) -> dict:
         dpi = self.dpi_spin.value() if fmt == "png" else None
         scale = self.scale_spin.value()
-        return {"dpi": dpi, "scale": scale}
+        # raster_dpi：SVG 栅格化（复制位图等）时使用的 DPI，与输出格式无关
+        return {"dpi": dpi, "scale": scale, "raster_dpi": self.dpi_spin.value()}
 
-    def render_preview(self) -> None:
-        text = self.editor.toPlainText().strip()
-        if not text:
-            # 空内容不渲染，显示占位
-            self.preview_stack.setCurrentWidget(self.page_placeholder)
-            return
-        if not self._is_puml_text(text):
-            self.page_error.setText("当前文本不是有效的PlantUML描述，已跳过渲染")
-            self.preview_stack.setCurrentWidget(self.page_error)
-            return
+    def _current_options(self) -> tuple[str, dict]:
         fmt = self.format_combo.currentText()
-        opts = self._get_quality_options(fmt)
-        preview_fmt = fmt if not (fmt == "svg" and not SVG_WIDGET_AVAILABLE) else "png"
-        self._logger.info("Render preview requested: fmt=%s opts=%s", preview_fmt, opts)
-
-        # 自动包裹 @startuml/@enduml，避免用户忘记标记导致渲染异常
-        render_text = text
-        if "@startuml" not in text:
-            render_text = f"@startuml\n{text}\n@enduml"
-
-        # 若已有渲染任务在执行，忽略新的渲染请求以避免竞争
-        if self._render_worker is not None and self._render_worker.isRunning():
+        return fmt, self._get_quality_options(fmt)
+
+    def current_tab(self) -> Optional[DocumentTab]:
+        tab = self.tabs.currentWidget()
+        return tab if isinstance(tab, DocumentTab) else None
+
+    def new_tab(self) -> DocumentTab:
+        self._untitled_counter += 1
+        tab = DocumentTab(self.service, self.scheduler, self._current_options, f"未命名 {self._untitled_counter}")
+        tab.status_message.connect(self._on_tab_status)
+        tab.title_changed.connect(lambda title, t=tab: self._on_tab_title_changed(t, title))
+        if self._engine_ready:
+            tab.show_placeholder()
+        index = self.tabs.addTab(tab, tab.title)
+        self.tabs.setCurrentIndex(index)
+        return tab
+
+    def _close_tab(self, index: int) -> None:
+        tab = self.tabs.widget(index)
+        if not isinstance(tab, DocumentTab):
             return
+        tab.shutdown()
+        self.tabs.removeTab(index)
+        tab.deleteLater()
+        if self.tabs.count() == 0:
+            self.new_tab()
+
+    def _on_current_tab_changed(self, index: int) -> None:
+        # 可见标签页的预览优先渲染，其余标签页降为空闲优先级
+        tab = self.current_tab()
+        self.scheduler.set_visible(tab)
+        if tab is not None:
+            self.setWindowTitle(f"{tab.title} - PlanUML 图形化工具")
+
+    def _on_tab_title_changed(self, tab: DocumentTab, title: str) -> None:
+        index = self.tabs.indexOf(tab)
+        if index >= 0:
+            self.tabs.setTabText(index, title)
+            self.tabs.setTabToolTip(index, str(tab.current_file) if tab.current_file else title)
+        if tab is self.current_tab():
+            self.setWindowTitle(f"{title} - PlanUML 图形化工具")
+
+    def _on_tab_status(self, text: str, timeout: int) -> None:
+        if self.sender() is self.current_tab():
+            self.status.showMessage(text, timeout)
 
-        # 显示加载页，异步渲染
-        self.preview_stack.setCurrentWidget(self.page_loading)
-        worker = _RenderWorker(self.service, render_text, preview_fmt, opts.get("dpi"), opts.get("scale"))
-        worker.done.connect(self._on_render_done)
-        worker.error.connect(self._on_render_error)
-        worker.finished.connect(self._clear_render_worker)
-        self._render_worker = worker
-        worker.start()
+    def render_preview(self) -> None:
+        tab = self.current_tab()
+        if tab:
+            tab.render_preview(use_history=False)
 
     def save_output(self) -> None:
-        text = self.editor.toPlainText().strip()
-        if not text:
-            QMessageBox.information(self, "提示", "请先输入PlantUML代码")
-            return
-        fmt = self.format_combo.currentText()
-        opts = self._get_quality_options(fmt)
-        try:
-            self._logger.info("Save output requested: fmt=%s opts=%s", fmt, opts)
-            result = self.service.render(text, fmt=fmt, dpi=opts.get("dpi"), scale=opts.get("scale"))
-            suffix = ".png" if fmt == "png" else ".svg"
-            fn, _ = QFileDialog.getSaveFileName(self, "保存输出", f"diagram{suffix}", f"*.{fmt}")
-            if fn:
-                Path(fn).write_bytes(result.bytes_data)
-                self.status.showMessage(f"已保存: {fn}", 3000)
-        except PlantUMLError as e:
-            QMessageBox.critical(self, "保存错误", str(e))
-
-    def _on_render_done(self, result: RenderResult) -> None:
-        self.current_result = result
-        if result.fmt == "png":
-            pix = QPixmap()
-            pix.loadFromData(result.bytes_data)
-            if pix.isNull():
-                self.preview_stack.setCurrentWidget(self.page_placeholder)
-            else:
-                self._original_pixmap = pix
-                self._base_size_png = pix.size()
-                self._zoom = 1.0
-                scaled = self._original_pixmap.scaled(self._base_size_png * self._zoom, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
-                self.png_label.setPixmap(scaled)
-                self.png_label.resize(scaled.size())
-                self.preview_stack.setCurrentWidget(self.page_png)
-        else:
-            if self.svg_widget:
-                try:
-                    self.svg_widget.load(result.bytes_data)
-                    # 记录基础尺寸并应用缩放
-                    try:
-                        renderer = self.svg_widget.renderer()
-                        self._base_size_svg = renderer.defaultSize()
-                    except Exception:
-                        self._base_size_svg = None
-                    self._zoom = 1.0
-                    if self._base_size_svg:
-                        self.svg_widget.resize(int(self._base_size_svg.width() * self._zoom), int(self._base_size_svg.height() * self._zoom))
-                    self.preview_stack.setCurrentWidget(self.page_svg)
-                except Exception:
-                    self.preview_stack.setCurrentWidget(self.page_png)
-            else:
-                self.preview_stack.setCurrentWidget(self.page_png)
-        self.status.showMessage("渲染成功", 2000)
-
-    def _on_render_error(self, msg: str) -> None:
-        self.page_error.setText(f"渲染错误：\n{msg}")
-        self.preview_stack.setCurrentWidget(self.page_error)
-        self.status.showMessage("渲染失败", 3000)
-
-    def _clear_render_worker(self) -> None:
-        self._render_worker = None
-
-    def eventFilter(self, obj, event):
-        if event.type() == QEvent.Type.Wheel and (obj is self.png_scroll.viewport() or obj is (self.svg_scroll.viewport() if self.svg_widget else None)):
-            delta = event.angleDelta().y()
-            step = 1.1 if delta > 0 else 1/1.1
-            new_zoom = max(0.25, min(6.0, self._zoom * step))
-            if abs(new_zoom - self._zoom) > 1e-3:
-                self._zoom = new_zoom
-                self._apply_zoom()
-                self.status.showMessage(f"缩放 {int(self._zoom * 100)}%", 800)
-            return True
-        return super().eventFilter(obj, event)
-
-    def _apply_zoom(self) -> None:
-        if not self.current_result:
-            return
-        if self.current_result.fmt == "png" and self._original_pixmap and self._base_size_png:
-            scaled = self._original_pixmap.scaled(self._base_size_png * self._zoom, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
-            self.png_label.setPixmap(scaled)
-            self.png_label.resize(scaled.size())
-            self.preview_stack.setCurrentWidget(self.page_png)
-        elif self.current_result.fmt == "svg" and self.svg_widget and self._base_size_svg:
-            self.svg_widget.resize(int(self._base_size_svg.width() * self._zoom), int(self._base_size_svg.height() * self._zoom))
-            self.preview_stack.setCurrentWidget(self.page_svg)
+        tab = self.current_tab()
+        if tab:
+            tab.save_output()
 
     def copy_to_clipboard(self) -> None:
-        if not self.current_result:
-            QMessageBox.information(self, "提示", "请先渲染以生成预览")
-            return
-        cb = QApplication.clipboard()
-        if self.current_result.fmt == "png":
-            pix = QPixmap()
-            pix.loadFromData(self.current_result.bytes_data)
-            cb.setPixmap(pix)
-            self.status.showMessage("PNG已复制到剪贴板", 2000)
-        else:
-            # 尝试复制栅格化预览；同时复制SVG文本到剪贴板文本通道
-            if self.current_result.svg_text:
-                cb.setText(self.current_result.svg_text)
-            pix = QPixmap()
-            pix.loadFromData(self.current_result.bytes_data)
-            if not pix.isNull():
-                cb.setPixmap(pix)
-                self.status.showMessage("SVG图像/文本已复制到剪贴板", 2000)
-            else:
-                self.status.showMessage("已复制SVG文本到剪贴板", 2000)
+        tab = self.current_tab()
+        if tab:
+            tab.copy_to_clipboard()
 
     def _open_file(self) -> None:
         fn, _ = QFileDialog.getOpenFileName(self, "打开PlantUML文件", "", "PlantUML (*.puml *.plantuml *.iuml);;所有文件 (*.*)")
         if fn:
+            path = Path(fn)
+            # 已打开的文件直接切换到对应标签页
+            for i in range(self.tabs.count()):
+                tab = self.tabs.widget(i)
+                if isinstance(tab, DocumentTab) and tab.current_file == path:
+                    self.tabs.setCurrentIndex(i)
+                    return
+            tab = self.current_tab()
+            if tab is None or not tab.is_pristine():
+                tab = self.new_tab()
             try:
-                content = Path(fn).read_text(encoding="utf-8")
-                self.editor.setPlainText(content)
+                tab.load_file(path)
                 self.status.showMessage(f"已打开: {fn}", 2000)
             except Exception as e:
                 QMessageBox.critical(self, "打开错误", str(e))
 
     def closeEvent(self, event: QCloseEvent) -> None:
         try:
-            self._debounce.stop()
+            for i in range(self.tabs.count()):
+                tab = self.tabs.widget(i)
+                if isinstance(tab, DocumentTab):
+                    tab.shutdown()
         except Exception:
             pass
         try:
-            if self._render_worker and self._render_worker.isRunning():
-                try:
-                    self._render_worker.requestInterruption()
-                except Exception:
-                    pass
+            self.scheduler.shutdown()
         except Exception:
             pass
         try:
@@ -465,8 +346,9 @@ class MainWindow(QMainWindow):
 
     def _start_resource_loading(self) -> None:
         # 启动时加载JAR，显示加载进度
-        self.preview_stack.setCurrentWidget(self.page_loading)
-        self.loading_label.setText("正在加载PlantUML引擎…")
+        tab = self.current_tab()
+        if tab:
+            tab.show_loading(0, "正在加载PlantUML引擎…")
         loader = _JarLoader(self.service)
         loader.progress.connect(self._on_load_progress)
         loader.done.connect(self._on_load_done)
@@ -474,36 +356,33 @@ class MainWindow(QMainWindow):
         self._jar_loader = loader
 
     def _on_load_progress(self, value: int, text: str) -> None:
-        self.loading_bar.setRange(0, 100)
-        self.loading_bar.setValue(value)
-        self.loading_label.setText(text)
+        tab = self.current_tab()
+        if tab:
+            tab.show_loading(value, text)
 
     def _on_load_done(self, ok: bool, err: str | None) -> None:
+        tab = self.current_tab()
         if ok:
-            self.loading_bar.setRange(0, 0)
-            self.preview_stack.setCurrentWidget(self.page_placeholder)
+            self._engine_ready = True
+            for i in range(self.tabs.count()):
+                other = self.tabs.widget(i)
+                if isinstance(other, DocumentTab) and not other.is_rendering():
+                    other.show_placeholder()
+            self.scheduler.set_visible(tab)
+            self.scheduler.set_ready()
             # 首次渲染：确保第一张图片显示
-            if not self.editor.toPlainText().strip():
-                self.editor.setPlainText("""@startuml
+            if tab and not tab.editor.toPlainText().strip():
+                tab.editor.setPlainText("""@startuml
 Alice -> Bob: Hello
 Bob --> Alice: Hi
 @enduml""")
             # 使用轻微延迟触发，确保UI稳定；若已有渲染任务，避免重复
-            QTimer.singleShot(200, lambda: (self._render_worker is None or not self._render_worker.isRunning()) and self.render_preview())
+            QTimer.singleShot(200, lambda: tab is not None and not tab.is_rendering() and tab.render_preview())
         else:
-            self.preview_stack.setCurrentWidget(self.page_placeholder)
+            if tab:
+                tab.show_placeholder()
             QMessageBox.critical(self, "资源加载失败", err or "未知错误")
 
-    def _is_puml_text(self, text: str) -> bool:
-        t = text.strip()
-        if not t:
-            return False
-        if "@startuml" in t and "@enduml" in t:
-            return True
-        # 简单启发式：包含关系箭头或skinparam等关键字时认为是PUML
-        keywords = ["->", "-->", "skinparam", "class ", "actor ", "usecase ", "rectangle ", "interface ", "note ", "partition "]
-        return any(k in t for k in keywords)
-
 
 class _JarLoader(QThread):
     progress = pyqtSignal(int, str)
@@ -529,25 +408,5 @@ class _JarLoader(QThread):
             self.done.emit(False, str(e))
 
 
-class _RenderWorker(QThread):
-    done = pyqtSignal(RenderResult)
-    error = pyqtSignal(str)
-
-    def __init__(self, service: PlantUMLService, text: str, fmt: str, dpi: int | None, scale: float | None):
-        super().__init__()
-        self._service = service
-        self._text = text
-        self._fmt = fmt
-        self._dpi = dpi
-        self._scale = scale
-
-    def run(self) -> None:
-        try:
-            result = self._service.render(self._text, fmt=self._fmt, dpi=self._dpi, scale=self._scale)
-            self.done.emit(result)
-        except PlantUMLError as e:
-            self.error.emit(str(e))
-
-
 def create_main_window(jar_path: str) -> MainWindow:
-    return MainWindow(jar_path)
+    return MainWindow(PlantUMLService(jar_path))
@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional
+
+from PyQt6.QtGui import QImage
+
+from services.plantuml_service import RenderResult
+
+
+@dataclass
+class HistoryEntry:
+    key: str
+    source_text: str
+    undo_steps: int
+    result: RenderResult
+    image: Optional[QImage] = None
+    thumbnail: Optional[QImage] = None
+    # 发起渲染时的请求（渲染文本与选项），编辑时据此廉价地查找历史
+    request: tuple = ()
+    created_at: float = field(default_factory=time.time)
+
+    @property
+    def nbytes(self) -> int:
+        size = len(self.result.bytes_data) + len(self.source_text.encode("utf-8"))
+        if self.result.svg_text:
+            size += len(self.result.svg_text)
+        for img in (self.image, self.thumbnail):
+            if img is not None and not img.isNull():
+                size += img.sizeInBytes()
+        return size
+
+
+class RenderHistory:
+    # 最近渲染结果的环形缓冲：按条目数与总字节数双重限制，超出时淘汰最旧条目
+    def __init__(self, max_entries: int = 20, max_bytes: int = 64 * 1024 * 1024):
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._entries: OrderedDict[str, HistoryEntry] = OrderedDict()
+        # 请求 -> 缓存键；同一请求可能因被包含文件变化对应不同结果，只记最近一次
+        self._requests: dict[tuple, str] = {}
+        self._total_bytes = 0
+
+    def get(self, key: str) -> Optional[HistoryEntry]:
+        return self._entries.get(key)
+
+    def find(self, request: tuple) -> Optional[HistoryEntry]:
+        key = self._requests.get(request)
+        return self._entries.get(key) if key is not None else None
+
+    def add(self, entry: HistoryEntry) -> None:
+        old = self._entries.pop(entry.key, None)
+        if old is not None:
+            self._total_bytes -= old.nbytes
+        self._entries[entry.key] = entry
+        self._requests[entry.request] = entry.key
+        self._total_bytes += entry.nbytes
+        while self._entries and (len(self._entries) > self._max_entries or self._total_bytes > self._max_bytes):
+            _, evicted = self._entries.popitem(last=False)
+            self._total_bytes -= evicted.nbytes
+            if self._requests.get(evicted.request) == evicted.key:
+                del self._requests[evicted.request]
+
+    def entries(self) -> list[HistoryEntry]:
+        return list(self._entries.values())
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
@@ -0,0 +1,459 @@
+from __future__ import annotations
+
+import itertools
+import logging
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Optional
+
+from PyQt6.QtCore import QBuffer, QByteArray, QIODevice, QObject, QSize, QThread, Qt, pyqtSignal
+from PyQt6.QtGui import QImage, QPainter
+
+try:
+    from PyQt6.QtSvgWidgets import QSvgWidget  # type: ignore  # noqa: F401
+    SVG_WIDGET_AVAILABLE = True
+except Exception:
+    SVG_WIDGET_AVAILABLE = False
+
+try:
+    from PyQt6.QtSvg import QSvgRenderer  # type: ignore
+    SVG_RENDERER_AVAILABLE = True
+except Exception:
+    SVG_RENDERER_AVAILABLE = False
+
+from services.plantuml_service import (
+    PlantUMLCancelled,
+    PlantUMLError,
+    PlantUMLService,
+    PlantUMLTimeout,
+    RenderCancelToken,
+    RenderResult,
+)
+
+try:
+    from utils.config import BATCH_RENDER_TIMEOUT, PREVIEW_RENDER_TIMEOUT, SVG_PREVIEW_RASTER_BYTES
+except Exception:
+    PREVIEW_RENDER_TIMEOUT = 15.0
+    BATCH_RENDER_TIMEOUT = 60.0
+    SVG_PREVIEW_RASTER_BYTES = 128 * 1024
+
+# 渲染优先级：数值越小越先执行
+PRIORITY_VISIBLE = 0
+PRIORITY_IDLE = 10
+
+# 历史缩略图的最大边长（像素）
+THUMBNAIL_SIZE = 96
+
+
+@dataclass
+class _RenderJob:
+    owner: object
+    text: str
+    fmt: str
+    dpi: Optional[int]
+    scale: Optional[float]
+    base_dir: Optional[Path]
+    on_done: Callable[[RenderResult, object, object], None]
+    on_error: Callable[[str], None]
+    seq: int
+
+
+class RenderScheduler(QObject):
+    # 所有标签页共享的渲染队列：每个文档至多一个待执行任务（新任务取代旧任务），
+    # 可见文档优先；后台文档按提交顺序以空闲优先级执行，并为可见文档保留一个并发槽位。
+    # 已取消但其JVM渲染仍在运行的任务同样计入并发数，使上限反映真实的CPU占用；
+    # 超时（或被取代后超过截止时间）的渲染视为挂起，不再占用槽位。超时渲染最终完成时，
+    # 若文档没有更新的请求，则把写入缓存的结果补发给文档
+    def __init__(self, service: PlantUMLService, max_concurrent: int = 2, parent: Optional[QObject] = None):
+        super().__init__(parent)
+        if max_concurrent < 1:
+            raise ValueError(f"max_concurrent must be >= 1, got {max_concurrent}")
+        self._service = service
+        self._max_concurrent = max_concurrent
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._seq = itertools.count()
+        self._pending: dict[object, _RenderJob] = {}
+        self._running: dict[object, tuple[_RenderJob, _RenderWorker]] = {}
+        # 已取消但线程（及其JVM渲染）尚未退出的任务，保持引用直到 finished
+        self._retired: list[_RenderWorker] = []
+        # 已超时、仍在等待JVM渲染结束的任务（不计入并发）；文档有新请求后任务置空
+        self._overdue: dict[_RenderWorker, Optional[_RenderJob]] = {}
+        # SVG栅格化线程及其回调；文档关闭后回调置空，线程引用保留到 finished
+        self._rasters: dict[RasterWorker, Optional[tuple[object, Callable[[RenderResult, object], None], Callable[[str], None]]]] = {}
+        self._visible: Optional[object] = None
+        self._ready = False
+
+    def set_ready(self) -> None:
+        # JVM 加载完成前只排队不执行，避免多个线程同时启动JVM
+        self._ready = True
+        self._pump()
+
+    def set_visible(self, owner: Optional[object]) -> None:
+        self._visible = owner
+        # 已在执行的任务随可见性调整优先级与超时
+        for running_owner, (_, worker) in self._running.items():
+            worker.set_visible(running_owner is owner)
+        self._pump()
+
+    def submit(
+        self,
+        owner: object,
+        text: str,
+        fmt: str,
+        dpi: Optional[int],
+        scale: Optional[float],
+        base_dir: Optional[Path],
+        on_done: Callable[[RenderResult, object, object], None],
+        on_error: Callable[[str], None],
+    ) -> None:
+        self._cancel_running(owner)
+        self._drop_overdue(owner)
+        self._pending[owner] = _RenderJob(owner, text, fmt, dpi, scale, base_dir, on_done, on_error, next(self._seq))
+        self._pump()
+
+    def cancel(self, owner: object) -> None:
+        self._pending.pop(owner, None)
+        self._cancel_running(owner)
+        self._drop_overdue(owner)
+
+    def rasterize(
+        self,
+        owner: object,
+        svg_result: RenderResult,
+        dpi: Optional[int],
+        scale: float,
+        on_done: Callable[[RenderResult, object], None],
+        on_error: Callable[[str], None],
+    ) -> None:
+        # 栅格化不经过JVM、耗时短，不参与排队，直接启动
+        worker = RasterWorker(self._service, svg_result, dpi, scale)
+        worker.done.connect(self._on_raster_done)
+        worker.error.connect(self._on_raster_error)
+        worker.finished.connect(self._on_raster_finished)
+        self._rasters[worker] = (owner, on_done, on_error)
+        worker.start()
+
+    def forget(self, owner: object) -> None:
+        # 文档关闭：取消其渲染，并丢弃尚未送达的栅格化结果
+        self.cancel(owner)
+        for worker, callbacks in self._rasters.items():
+            if callbacks is not None and callbacks[0] is owner:
+                self._rasters[worker] = None
+
+    def is_busy(self, owner: object) -> bool:
+        return owner in self._pending or owner in self._running
+
+    def shutdown(self) -> None:
+        self._pending.clear()
+        for owner in list(self._running):
+            self._cancel_running(owner)
+        # 退出时不再等待被放弃的JVM渲染（守护线程随进程结束），只等工作线程自身返回
+        for worker in self._retired + list(self._overdue):
+            worker.release()
+            worker.wait(1000)
+        for worker in self._rasters:
+            self._rasters[worker] = None
+            worker.wait(1000)
+
+    def _cancel_running(self, owner: object) -> None:
+        running = self._running.pop(owner, None)
+        if running is None:
+            return
+        _, worker = running
+        worker.cancel()
+        self._retired.append(worker)
+
+    def _drop_overdue(self, owner: object) -> None:
+        for worker, job in self._overdue.items():
+            if job is not None and job.owner is owner:
+                self._overdue[worker] = None
+                worker.release()
+
+    def _priority(self, owner: object) -> int:
+        return PRIORITY_VISIBLE if owner is self._visible else PRIORITY_IDLE
+
+    def _pump(self) -> None:
+        if not self._ready:
+            return
+        # 只有一个槽位时不做保留，后台任务仅在没有可见任务排队时执行（由优先级排序保证）
+        idle_limit = max(1, self._max_concurrent - 1)
+        while self._pending and len(self._running) + len(self._retired) < self._max_concurrent:
+            idle_running = sum(1 for owner in self._running if self._priority(owner) == PRIORITY_IDLE)
+            candidates = [
+                job for job in self._pending.values()
+                if job.owner not in self._running
+                and (self._priority(job.owner) == PRIORITY_VISIBLE or idle_running < idle_limit)
+            ]
+            if not candidates:
+                return
+            job = min(candidates, key=lambda j: (self._priority(j.owner), j.seq))
+            del self._pending[job.owner]
+            self._start(job)
+
+    def _start(self, job: _RenderJob) -> None:
+        visible = self._priority(job.owner) == PRIORITY_VISIBLE
+        worker = _RenderWorker(self._service, job.text, job.fmt, job.dpi, job.scale, job.base_dir, job.owner, visible)
+        worker.done.connect(self._on_worker_done)
+        worker.error.connect(self._on_worker_error)
+        worker.timed_out.connect(self._on_worker_timed_out)
+        worker.finished.connect(self._on_worker_finished)
+        self._running[job.owner] = (job, worker)
+        worker.start(_thread_priority(visible))
+
+    def _job_for(self, worker: QObject) -> Optional[_RenderJob]:
+        for job, running in self._running.values():
+            if running is worker:
+                return job
+        return None
+
+    def _on_worker_done(self, result: RenderResult, image: object, thumbnail: object) -> None:
+        worker = self.sender()
+        job = self._job_for(worker) or self._overdue.get(worker)
+        if job is not None:
+            job.on_done(result, image, thumbnail)
+
+    def _on_worker_error(self, msg: str) -> None:
+        job = self._job_for(self.sender())
+        if job is not None:
+            job.on_error(msg)
+
+    def _on_worker_timed_out(self, msg: str) -> None:
+        worker = self.sender()
+        job = self._job_for(worker)
+        if job is not None:
+            del self._running[job.owner]
+            job.on_error(msg)
+        elif worker in self._retired:
+            # 超时信号送达前已被新请求取代：不再补发结果
+            self._retired.remove(worker)
+            worker.release()
+        else:
+            return
+        self._overdue[worker] = job
+        self._pump()
+
+    def _on_raster_done(self, result: RenderResult, image: object) -> None:
+        callbacks = self._rasters.get(self.sender())
+        if callbacks is not None:
+            callbacks[1](result, image)
+
+    def _on_raster_error(self, msg: str) -> None:
+        callbacks = self._rasters.get(self.sender())
+        if callbacks is not None:
+            callbacks[2](msg)
+
+    def _on_raster_finished(self) -> None:
+        self._rasters.pop(self.sender(), None)
+
+    def _on_worker_finished(self) -> None:
+        worker = self.sender()
+        job = self._job_for(worker)
+        if job is not None:
+            del self._running[job.owner]
+        elif worker in self._retired:
+            self._retired.remove(worker)
+        self._overdue.pop(worker, None)
+        self._pump()
+
+
+def _thread_priority(visible: bool) -> QThread.Priority:
+    return QThread.Priority.NormalPriority if visible else QThread.Priority.IdlePriority
+
+
+class _RenderWorker(QThread):
+    # 附带工作线程中解码好的 QImage（无需栅格化时为 None）与历史缩略图
+    done = pyqtSignal(RenderResult, object, object)
+    error = pyqtSignal(str)
+    # 超时：调度器收回槽位；渲染最终完成时仍会发出 done
+    timed_out = pyqtSignal(str)
+
+    def __init__(self, service: PlantUMLService, text: str, fmt: str, dpi: int | None, scale: float | None, base_dir: Path | None = None, group: object = None, visible: bool = True):
+        super().__init__()
+        self._service = service
+        self._text = text
+        self._fmt = fmt
+        self._dpi = dpi
+        self._scale = scale
+        self._base_dir = base_dir
+        # 同一文档的渲染共用一个组：被取代的渲染结束前不会启动新的JVM渲染；
+        # 优先级与超时由令牌带到真正执行 outputImage 的线程上
+        self._cancel = RenderCancelToken(group, low_priority=not visible, timeout=_render_timeout(visible))
+        self._released = False
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+    def cancel(self) -> None:
+        self._cancel.cancel()
+        self.requestInterruption()
+
+    def release(self) -> None:
+        self._released = True
+
+    def _wait_render_exited(self, until_overdue: bool = False) -> bool:
+        # 保持线程存活直到被放弃的JVM渲染真正结束，调度器据此统计实际并发；
+        # until_overdue：渲染超过截止时间仍未结束即视为挂起，不再等待
+        while not self._released:
+            if self._cancel.wait_render_exited(0.1):
+                return True
+            if until_overdue and self._cancel.render_overdue:
+                return False
+        return False
+
+    def set_visible(self, visible: bool) -> None:
+        self._cancel.set_low_priority(not visible)
+        self._cancel.set_timeout(_render_timeout(visible))
+        if self.isRunning():
+            self.setPriority(_thread_priority(visible))
+
+    def run(self) -> None:
+        # PNG 未缓存但同一图表的 SVG 已缓存时，直接栅格化 SVG，免去再次调用JVM布局
+        result: Optional[RenderResult] = None
+        svg = self._cached_svg()
+        if svg is not None:
+            t0 = time.perf_counter()
+            try:
+                result, image = rasterize_cached_svg(self._service, svg, self._dpi)
+                # 以本次请求的缓存键标识结果（含 !include 指纹），供文档的历史环索引
+                result.cache_key = self._service.cache_key(self._text, self._fmt, self._dpi, self._scale, self._base_dir)
+                self._logger.info("Preview rasterized from cached SVG: %.2f ms", (time.perf_counter() - t0) * 1000.0)
+            except PlantUMLError as e:
+                self._logger.warning("Rasterizing cached SVG failed, falling back to render: %s", e)
+        if result is None:
+            try:
+                result = self._service.render(self._text, fmt=self._fmt, dpi=self._dpi, scale=self._scale, cancel=self._cancel, base_dir=self._base_dir)
+            except PlantUMLCancelled:
+                self._wait_render_exited(until_overdue=True)
+                self._logger.info("Render superseded, result discarded")
+                return
+            except PlantUMLTimeout as e:
+                self.timed_out.emit(str(e))
+                result = self._late_result()
+                if result is None:
+                    return
+            except PlantUMLError as e:
+                self.error.emit(str(e))
+                return
+            if self.isInterruptionRequested():
+                return
+            t0 = time.perf_counter()
+            image = decode_preview_image(result)
+            self._logger.info("Preview decode (%s): %.2f ms", result.fmt, (time.perf_counter() - t0) * 1000.0)
+        if self.isInterruptionRequested():
+            return
+        thumbnail = make_thumbnail(result, image)
+        self.done.emit(result, image, thumbnail)
+
+
+    def _cached_svg(self) -> Optional[RenderResult]:
+        if self._fmt != "png" or not SVG_RENDERER_AVAILABLE:
+            return None
+        if self._service.lookup(self._text, "png", self._dpi, self._scale, self._base_dir) is not None:
+            return None
+        return self._service.lookup(self._text, "svg", None, self._scale, self._base_dir)
+
+    def _late_result(self) -> Optional[RenderResult]:
+        # 等待超时被放弃的渲染跑完，取回其写入缓存的结果；期间文档有新请求则放弃
+        if not self._wait_render_exited():
+            return None
+        result = self._service.lookup(self._text, self._fmt, self._dpi, self._scale, self._base_dir)
+        if result is not None:
+            self._logger.info("Timed-out render finished late, delivering cached result")
+        return result
+
+
+class RasterWorker(QThread):
+    # 将已缓存的 SVG 结果栅格化为指定 DPI/缩放的 PNG，结果缓存在SVG条目旁
+    done = pyqtSignal(RenderResult, object)
+    error = pyqtSignal(str)
+
+    def __init__(self, service: PlantUMLService, svg_result: RenderResult, dpi: int | None, scale: float = 1.0):
+        super().__init__()
+        self._service = service
+        self._svg_result = svg_result
+        self._dpi = dpi
+        self._scale = scale
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+    def run(self) -> None:
+        if not SVG_RENDERER_AVAILABLE:
+            self.error.emit("QtSvg 不可用，无法栅格化SVG")
+            return
+        t0 = time.perf_counter()
+        try:
+            result, image = rasterize_cached_svg(self._service, self._svg_result, self._dpi, self._scale)
+        except PlantUMLError as e:
+            self.error.emit(str(e))
+            return
+        self._logger.info("SVG rasterized at %s dpi x%g: %.2f ms", self._dpi or 96, self._scale, (time.perf_counter() - t0) * 1000.0)
+        self.done.emit(result, image)
+
+
+def rasterize_cached_svg(service: PlantUMLService, svg_result: RenderResult, dpi: Optional[int], scale: float = 1.0) -> tuple[RenderResult, QImage]:
+    # SVG 以 96dpi 为基准尺寸；dpi/scale 仅作用于栅格化，不再经过 PlantUML 布局
+    cached = service.get_raster(svg_result, dpi, scale)
+    if cached is not None:
+        image = QImage()
+        image.loadFromData(cached.bytes_data, "PNG")
+        if not image.isNull():
+            return cached, image
+    factor = (dpi or 96) / 96.0 * scale
+    image = rasterize_svg(svg_result.bytes_data, factor=factor)
+    if image is None:
+        raise PlantUMLError("SVG栅格化失败")
+    return service.put_raster(svg_result, dpi, scale, encode_png(image)), image
+
+
+def encode_png(image: QImage) -> bytes:
+    data = QByteArray()
+    buf = QBuffer(data)
+    buf.open(QIODevice.OpenModeFlag.WriteOnly)
+    image.save(buf, "PNG")
+    buf.close()
+    return bytes(data)
+
+
+def _render_timeout(visible: bool) -> float:
+    return PREVIEW_RENDER_TIMEOUT if visible else BATCH_RENDER_TIMEOUT
+
+
+def decode_preview_image(result: RenderResult) -> Optional[QImage]:
+    # QImage 可在非GUI线程安全使用；QPixmap 只能在GUI线程创建
+    if result.fmt == "png":
+        image = QImage()
+        image.loadFromData(result.bytes_data, "PNG")
+        return image
+    # 较小的SVG交给 QSvgWidget 以矢量显示；较大的（或无部件时）在此栅格化，GUI线程只做位图转换
+    if not SVG_RENDERER_AVAILABLE:
+        return None
+    if SVG_WIDGET_AVAILABLE and len(result.bytes_data) < SVG_PREVIEW_RASTER_BYTES:
+        return None
+    return rasterize_svg(result.bytes_data)
+
+
+def rasterize_svg(data: bytes, max_side: Optional[int] = None, factor: float = 1.0) -> Optional[QImage]:
+    renderer = QSvgRenderer(data)
+    if not renderer.isValid():
+        return None
+    size = renderer.defaultSize()
+    if size.isEmpty():
+        return None
+    if factor != 1.0:
+        size = QSize(max(1, round(size.width() * factor)), max(1, round(size.height() * factor)))
+    if max_side is not None:
+        size = size.scaled(max_side, max_side, Qt.AspectRatioMode.KeepAspectRatio)
+    image = QImage(size, QImage.Format.Format_ARGB32_Premultiplied)
+    image.fill(Qt.GlobalColor.white)
+    painter = QPainter(image)
+    try:
+        renderer.render(painter)
+    finally:
+        painter.end()
+    return image
+
+
+def make_thumbnail(result: RenderResult, image: Optional[QImage]) -> Optional[QImage]:
+    if image is None and result.fmt == "svg" and SVG_RENDERER_AVAILABLE:
+        image = rasterize_svg(result.bytes_data, THUMBNAIL_SIZE)
+    if image is None or image.isNull():
+        return None
+    return image.scaled(THUMBNAIL_SIZE, THUMBNAIL_SIZE, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
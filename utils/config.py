@@ -1 +1,13 @@
 LOG_ENABLED = False
+
+# 各调用方的渲染超时（秒），None 表示不限制
+PREVIEW_RENDER_TIMEOUT = 15.0
+EXPORT_RENDER_TIMEOUT = 120.0
+BATCH_RENDER_TIMEOUT = 60.0
+
+# 预览历史环的容量上限：条目数与总字节数
+HISTORY_MAX_ENTRIES = 20
+HISTORY_MAX_BYTES = 64 * 1024 * 1024
+
+# 超过该字节数的SVG预览在工作线程栅格化后以位图显示，避免在GUI线程解析；较小的SVG仍以矢量部件显示
+SVG_PREVIEW_RASTER_BYTES = 128 * 1024